@@ -10,6 +10,7 @@ from utils.core import create_sessions, logger
 from utils.telegram import PyrogramAccount, TelethonAccount, get_telegrams, AccountInterface
 from utils.starter import start
 from utils.core import get_all_lines
+from utils.blum import close_shared_session
 import argparse
 from data import config
 from utils.referrals import make_referrals
@@ -114,6 +115,20 @@ TON address for coffee: UQBhsu6Lsxu21AQdj6YMNdjCvCXuTxG-xdnWF4tOtQpICeiU
         elif platform == 'linux':
             logger.warning(f"Подпишитесь на канал автора https://t.me/{channel_username}")
 
+async def run():
+    try:
+        await main()
+    finally:
+        await close_shared_session()
+
 if __name__ == '__main__':
-    asyncio.run(main())
+    if platform == 'win32':
+        asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    else:
+        try:
+            import uvloop
+            uvloop.install()
+        except ImportError:
+            logger.info("uvloop is not installed, using the default event loop")
+    asyncio.run(run())
 
@@ -1,12 +1,86 @@
 import asyncio
+import base64
+import json
 import random
+import time
 
-from aiohttp import ClientSession
+import aiohttp
+from aiohttp import ClientSession, TCPConnector
+from yarl import URL
 
 from data import config
+from utils.agents import generate_random_user_agent
 from utils.core import logger
 from utils.telegram import AccountInterface
 
+try:
+    from aiocfscrape import CloudflareScraper
+    Session = CloudflareScraper
+except:
+    logger.info("Error when importing aiocfscrape.CloudflareScraper, using aiohttp.ClientSession instead")
+    Session = ClientSession
+
+try:
+    import orjson
+    json_loads = orjson.loads
+    def json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+except ImportError:
+    json_loads = json.loads
+    json_dumps = json.dumps
+
+try:
+    import aiodns  # noqa: F401  (aiohttp.AsyncResolver needs it)
+    AsyncResolver = aiohttp.AsyncResolver
+except ImportError:
+    AsyncResolver = None
+
+
+def make_blum_session(**kwargs) -> ClientSession:
+    """
+    Create a session with a connector tuned for keep-alive, so the TCP/TLS
+    handshakes to the blum hosts are paid once instead of per request. DNS
+    answers for the two blum hosts are cached for five minutes.
+    """
+    connector = TCPConnector(
+        ssl=False,
+        limit=100,
+        limit_per_host=20,
+        keepalive_timeout=75,
+        enable_cleanup_closed=True,
+        use_dns_cache=True,
+        ttl_dns_cache=300,
+        resolver=AsyncResolver() if AsyncResolver else None
+    )
+    return Session(connector=connector, json_serialize=json_dumps, **kwargs)
+
+
+REQUEST_TIMEOUT = aiohttp.ClientTimeout(total=60)
+
+_shared_session = None
+
+def get_shared_session() -> ClientSession:
+    """
+    Lazily create the process-wide session shared by all BlumBot instances.
+    One connection pool means TLS handshakes to the blum hosts are paid once
+    for the whole process instead of once per account. Per-account headers
+    (Authorization, User-Agent) are injected per request in BlumBot._req,
+    never stored here.
+    """
+    global _shared_session
+    if _shared_session is None or _shared_session.closed:
+        _shared_session = make_blum_session(timeout=REQUEST_TIMEOUT)
+    return _shared_session
+
+async def close_shared_session():
+    """
+    Close the shared session. Call once at program shutdown.
+    """
+    global _shared_session
+    if _shared_session is not None and not _shared_session.closed:
+        await _shared_session.close()
+    _shared_session = None
+
 
 class RefCodeError(Exception):
     pass
@@ -14,7 +88,54 @@ class RefCodeError(Exception):
 class AccountUsedError(Exception):
     pass
 
+# Pre-parsed URLs so the hot request path skips yarl parsing per call
+GAME_API = URL('https://game-domain.blum.codes/api/v1')
+GATEWAY_API = URL('https://gateway.blum.codes/v1')
+
+TASKS_URL = GAME_API / 'tasks'
+DAILY_REWARD_URL = (GAME_API / 'daily-reward').with_query(offset=-180)
+GAME_PLAY_URL = GAME_API / 'game' / 'play'
+GAME_CLAIM_URL = GAME_API / 'game' / 'claim'
+FARMING_START_URL = GAME_API / 'farming' / 'start'
+FARMING_CLAIM_URL = GAME_API / 'farming' / 'claim'
+BALANCE_URL = GAME_API / 'user' / 'balance'
+FRIENDS_BALANCE_URL = GATEWAY_API / 'friends' / 'balance'
+FRIENDS_CLAIM_URL = GATEWAY_API / 'friends' / 'claim'
+AUTH_REFRESH_URL = GATEWAY_API / 'auth' / 'refresh'
+AUTH_PROVIDER_URL = GATEWAY_API / 'auth' / 'provider' / 'PROVIDER_TELEGRAM_MINI_APP'
+
+# Statuses worth retrying: rate limit and transient upstream errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# How long the friends/balance response stays valid, in seconds
+FRIENDS_CACHE_TTL = 60
+
+# Assumed access-token lifetime when the JWT exp claim can't be parsed
+DEFAULT_TOKEN_TTL = 3600
+
+# Refresh the token this many seconds before it is due to expire
+TOKEN_REFRESH_SKEW = 60
+
+
+def _jwt_ttl(access: str) -> float:
+    """
+    Lifetime in seconds of a JWT access token, taken from its exp claim.
+    Falls back to DEFAULT_TOKEN_TTL when the token can't be parsed.
+    """
+    try:
+        payload = access.split('.')[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4)))
+        return max(claims['exp'] - time.time(), 0)
+    except Exception:
+        return DEFAULT_TOKEN_TTL
+
 class BlumBot:
+    # With hundreds of concurrent accounts the per-instance __dict__ adds up;
+    # slots keep instances small and attribute access fast
+    __slots__ = ('account', 'session', 'refresh_token', '_auth', '_user_agent',
+                 '_friends_cache', '_token_ts', '_token_ttl', '_refresh_lock',
+                 '_rng', '_refresh_body', '_claim_body')
+
     def __init__(
             self, 
             account: AccountInterface, 
@@ -26,22 +147,105 @@ class BlumBot:
         self.account = account
         self.session = session
         self.refresh_token = ''
+        self._auth = ''
+        self._user_agent = generate_random_user_agent(device_type='android',
+                                                      browser_type='chrome')
+        self._friends_cache = None
+        self._token_ts = 0.0
+        self._token_ttl = DEFAULT_TOKEN_TTL
+        self._refresh_lock = asyncio.Lock()
+        # Per-account RNG: avoids contention on the global random state when
+        # many accounts run concurrently
+        self._rng = random.Random(hash(account))
+        # Reused request bodies, mutated in place instead of rebuilt per call
+        self._refresh_body = {'refresh': None}
+        self._claim_body = {'gameId': None, 'points': None}
+
+    async def _req(self, method: str, url, *, ensure_token: bool = True, **kwargs):
+        """
+        Issue a request with this account's Authorization and User-Agent
+        headers. The session may be shared between accounts, so both are
+        injected per call instead of being stored on the session headers.
+        """
+        if ensure_token:
+            await self._ensure_token()
+        headers = kwargs.setdefault('headers', {})
+        headers.setdefault('User-Agent', self._user_agent)
+        if self._auth:
+            headers.setdefault('Authorization', self._auth)
+        return await self.session.request(method, url, **kwargs)
+
+    @staticmethod
+    async def _json(resp):
+        """
+        Decode a response body with the faster loads when orjson is available.
+        """
+        return await resp.json(loads=json_loads)
+
+    def _apply_token(self, access: str, refresh: str):
+        """
+        Store a freshly issued token pair and stamp its issue time for the
+        proactive refresh check.
+        """
+        self._auth = "Bearer " + access
+        self.refresh_token = refresh
+        self._token_ts = time.monotonic()
+        self._token_ttl = _jwt_ttl(access)
+
+    async def _ensure_token(self):
+        """
+        Refresh the access token shortly before it expires, so requests never
+        pay the "call, get 401, refresh, retry" double round-trip. The lock
+        keeps concurrent requests from refreshing at the same time.
+        """
+        if not self._auth or not self.refresh_token:
+            return
+        if time.monotonic() - self._token_ts < self._token_ttl - TOKEN_REFRESH_SKEW:
+            return
+        async with self._refresh_lock:
+            if time.monotonic() - self._token_ts >= self._token_ttl - TOKEN_REFRESH_SKEW:
+                await self.refresh()
+
+    async def _request_with_retry(self, method: str, url, *, max_retries: int = 3,
+                                  base: float = 1.0, cap: float = 30, jitter: float = 0.5,
+                                  **kwargs):
+        """
+        Issue a request, retrying rate limits, transient 5xx and connection
+        errors with exponential backoff and jitter. The last response (or
+        connection error) is returned/raised as-is so callers keep their
+        existing handling.
+        """
+        for attempt in range(max_retries + 1):
+            try:
+                resp = await self._req(method, url, **kwargs)
+            except aiohttp.ClientError as e:
+                if attempt == max_retries:
+                    raise
+                logger.debug("{} | {} {} failed ({}), retrying", self.account, method, url, e)
+            else:
+                if resp.status not in RETRY_STATUSES or attempt == max_retries:
+                    return resp
+                logger.debug("{} | {} {} got {}, retrying", self.account, method, url, resp.status)
+                await resp.release()
+            await asyncio.sleep(min(cap, base * 2 ** attempt) * (1 + self._rng.uniform(0, jitter)))
 
     async def logout(self):
         """
-        Logout by closing the aiohttp session.
+        Logout by dropping the tokens. The session may be shared between
+        accounts, so it is closed at program shutdown, not here.
         """
-        await self.session.close()
+        self._auth = ''
+        self.refresh_token = ''
 
     async def claim_task(self, task: dict):
         """
         Claim a task given its task dictionary.
         """
-        resp = await self.session.post(f'https://game-domain.blum.codes/api/v1/tasks/{task["id"]}/claim',
- ssl=False)
-        resp_json = await resp.json()
+        resp = await self._req('POST', TASKS_URL / task["id"] / 'claim')
+        async with resp:
+            resp_json = await self._json(resp)
         
-        logger.debug(f"{self.account} | claim_task response: {resp_json}")
+        logger.debug("{} | claim_task response: {}", self.account, resp_json)
 
         return resp_json.get('status') == "CLAIMED"
 
@@ -49,20 +253,21 @@ class BlumBot:
         """
         Start a task given its task dictionary.
         """
-        resp = await self.session.post(f'https://game-domain.blum.codes/api/v1/tasks/{task["id"]}/start',
- ssl=False)
-        resp_json = await resp.json()
+        resp = await self._req('POST', TASKS_URL / task["id"] / 'start')
+        async with resp:
+            resp_json = await self._json(resp)
 
-        logger.debug(f"{self.account} | start_complete_task response: {resp_json}")
+        logger.debug("{} | start_complete_task response: {}", self.account, resp_json)
 
     async def get_tasks(self):
         """
         Retrieve the list of available tasks.
         """
-        resp = await self.session.get('https://game-domain.blum.codes/api/v1/tasks', ssl=False)
-        resp_json = await resp.json()
+        resp = await self._req('GET', TASKS_URL)
+        async with resp:
+            resp_json = await self._json(resp)
 
-        logger.debug(f"{self.account} | get_tasks response: {resp_json}")
+        logger.debug("{} | get_tasks response: {}", self.account, resp_json)
 
         # Ensure the response is a list of tasks
         if isinstance(resp_json, list):
@@ -71,63 +276,114 @@ class BlumBot:
             logger.error(f"{self.account} | Unexpected response format in get_tasks: {resp_json}")
             return []
 
-    async def play_game(self, play_passes: int):
+    async def refresh_state(self, with_tasks: bool = False):
         """
-        Play the game a specified number of times using available play passes.
+        Fetch balance and friend balance concurrently, plus the task list
+        when asked for. The GETs are independent, so overlapping them saves
+        a round-trip per extra leg.
         """
-        while play_passes:
-            try:
-                await asyncio.sleep(random.uniform(*config.DELAYS['PLAY']))
-                game_id = await self.start_game()
-
-                if not game_id or game_id == "cannot start game":
-                    logger.info(f"{self.account} | Couldn't start play in game! play_passes: {play_passes}")
-                    break
+        coros = [self.balance(), self.friend_balance()]
+        if with_tasks:
+            coros.append(self.get_tasks())
+        return await asyncio.gather(*coros)
 
-                await asyncio.sleep(random.uniform(30, 40))
+    async def run_tasks(self, max_concurrency: int = 5):
+        """
+        Fetch the task list and start/claim the doable ones concurrently.
+        A semaphore bounds the parallelism so one account can't flood the
+        shared connection pool.
+        """
+        tasks = await self.get_tasks()
+        doable = [task for task in tasks
+                  if task.get('title') not in config.BLACKLIST_TASKS
+                  and task.get('status') in ('NOT_STARTED', 'READY_FOR_CLAIM')]
+        if not doable:
+            return
 
-                msg, points = await self.claim_game(game_id)
-                if isinstance(msg, bool) and msg:
-                    logger.info(f"{self.account} | Finish play in game!; reward: {points}")
-                else:
-                    logger.info(f"{self.account} | Couldn't play game; msg: {msg} play_passes: {play_passes}")
-                    break
+        sem = asyncio.Semaphore(max_concurrency)
 
-                await asyncio.sleep(random.uniform(30, 40))
+        async def _do(task):
+            async with sem:
+                if task.get('status') == 'NOT_STARTED':
+                    await self.start_complete_task(task)
+                await self.claim_task(task)
 
-                play_passes -= 1
+        await asyncio.gather(*(_do(task) for task in doable))
 
-            except Exception as e:
-                logger.error(f"{self.account} | Error occurred during play_game: {e}")
-                await asyncio.sleep(random.uniform(*config.DELAYS['ERROR_PLAY']))
+    async def play_game(self, play_passes: int):
+        """
+        Play the game a specified number of times using available play passes.
+        The pacing sleep after a claim runs concurrently with starting the
+        next game, hiding that round-trip behind the wait.
+        """
+        next_game = None
+        try:
+            while play_passes:
+                try:
+                    if next_game is None:
+                        await asyncio.sleep(self._rng.uniform(*config.DELAYS['PLAY']))
+                        game_id = await self.start_game()
+                    else:
+                        pending, next_game = next_game, None
+                        game_id = await pending
+
+                    if not game_id or game_id == "cannot start game":
+                        logger.info(f"{self.account} | Couldn't start play in game! play_passes: {play_passes}")
+                        break
+
+                    await asyncio.sleep(self._rng.uniform(30, 40))
+
+                    msg, points = await self.claim_game(game_id)
+                    if isinstance(msg, bool) and msg:
+                        logger.info(f"{self.account} | Finish play in game!; reward: {points}")
+                    else:
+                        logger.info(f"{self.account} | Couldn't play game; msg: {msg} play_passes: {play_passes}")
+                        break
+
+                    play_passes -= 1
+
+                    pacing = asyncio.sleep(self._rng.uniform(30, 40))
+                    if play_passes:
+                        # Kick off the next game so its round-trip hides
+                        # behind the pacing sleep
+                        next_game = asyncio.create_task(self.start_game())
+                    await pacing
+
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    logger.error(f"{self.account} | Error occurred during play_game: {e}")
+                    await asyncio.sleep(self._rng.uniform(*config.DELAYS['ERROR_PLAY']))
+        finally:
+            if next_game is not None:
+                next_game.cancel()
 
     async def claim_daily_reward(self):
         """
         Claim the daily reward.
         """
-        resp = await self.session.post("https://game-domain.blum.codes/api/v1/daily-reward?offset=-180",
- ssl=False)
-        txt = await resp.text()
-        await asyncio.sleep(1)
+        resp = await self._req('POST', DAILY_REWARD_URL)
+        async with resp:
+            txt = await resp.text()
         return True if txt == 'OK' else txt
 
     async def refresh(self):
         """
         Refresh the authorization token.
         """
-        json_data = {'refresh': self.refresh_token}
-        resp = await self.session.post("https://gateway.blum.codes/v1/auth/refresh", json=json_data, ssl=False)
-        resp_json = await resp.json()
+        self._refresh_body['refresh'] = self.refresh_token
+        resp = await self._req('POST', AUTH_REFRESH_URL, json=self._refresh_body,
+                               ensure_token=False)
+        async with resp:
+            resp_json = await self._json(resp)
 
-        self.session.headers['Authorization'] = "Bearer " + resp_json.get('access')
-        self.refresh_token = resp_json.get('refresh')
+        self._apply_token(resp_json.get('access'), resp_json.get('refresh'))
 
     async def start_game(self):
         """
         Start a new game and return the game ID.
         """
-        resp = await self.session.post("https://game-domain.blum.codes/api/v1/game/play", ssl=False)
-        response_data = await resp.json()
+        resp = await self._req('POST', GAME_PLAY_URL)
+        async with resp:
+            response_data = await self._json(resp)
         if "gameId" in response_data:
             return response_data.get("gameId")
         elif "message" in response_data:
@@ -137,15 +393,13 @@ class BlumBot:
         """
         Claim the reward for a completed game.
         """
-        points = random.randint(*config.POINTS)
-        json_data = {"gameId": game_id, "points": points}
+        points = self._rng.randint(*config.POINTS)
+        self._claim_body['gameId'] = game_id
+        self._claim_body['points'] = points
 
-        resp = await self.session.post("https://game-domain.blum.codes/api/v1/game/claim", json=json_data, ssl=False)
-        if resp.status != 200:
-            await asyncio.sleep(1)
-            resp = await self.session.post("https://game-domain.blum.codes/api/v1/game/claim", json=json_data, ssl=False)
-        
-        txt = await resp.text()
+        resp = await self._request_with_retry('POST', GAME_CLAIM_URL, json=self._claim_body)
+        async with resp:
+            txt = await resp.text()
 
         return True if txt == 'OK' else txt, points
 
@@ -153,81 +407,68 @@ class BlumBot:
         """
         Claim the farming rewards.
         """
-        resp = await self.session.post("https://game-domain.blum.codes/api/v1/farming/claim", ssl=False)
-        if resp.status != 200:
-            await asyncio.sleep(1)
-            resp = await self.session.post("https://game-domain.blum.codes/api/v1/farming/claim", ssl=False)
-        
-        resp_json = await resp.json()
+        resp = await self._request_with_retry('POST', FARMING_CLAIM_URL)
+        async with resp:
+            resp_json = await self._json(resp)
 
-        return int(resp_json.get("timestamp")/1000), resp_json.get("availableBalance")
+        return resp_json.get("timestamp") // 1000, resp_json.get("availableBalance")
 
     async def start(self):
         """
         Start the farming process.
         """
-        resp = await self.session.post("https://game-domain.blum.codes/api/v1/farming/start", ssl=False)
+        resp = await self._request_with_retry('POST', FARMING_START_URL)
+        # The body isn't needed; release the connection back to the pool
+        await resp.release()
+
+    async def _friends_balance_raw(self):
+        """
+        Fetch friends/balance, caching the JSON for a short TTL.
+        friend_balance and get_referral_code read different fields from the
+        same response, so one round-trip serves both.
+        """
+        now = time.monotonic()
+        if self._friends_cache and now - self._friends_cache[0] < FRIENDS_CACHE_TTL:
+            return self._friends_cache[1]
 
-        if resp.status != 200:
-            await asyncio.sleep(1)
-            resp = await self.session.post("https://game-domain.blum.codes/api/v1/farming/start", ssl=False)
+        resp = await self._request_with_retry('GET', FRIENDS_BALANCE_URL)
+        async with resp:
+            resp_json = await self._json(resp)
+        self._friends_cache = (now, resp_json)
+        return resp_json
 
     async def friend_balance(self):
         """
         Gets friend balance
         """
-        resp = await self.session.get("https://gateway.blum.codes/v1/friends/balance", ssl=False)
-        resp_json = await resp.json()
-        await asyncio.sleep(1)
+        resp_json = await self._friends_balance_raw()
 
-        claim_amount = resp_json.get("amountForClaim")
-        is_available = resp_json.get("canClaim")
-
-        if resp.status != 200:
-            resp = await self.session.get("https://gateway.blum.codes/v1/friends/balance", ssl=False)
-            resp_json = await resp.json()
-            claim_amount = resp_json.get("amountForClaim")
-            is_available = resp_json.get("canClaim")
-
-        return (claim_amount,
-                is_available)
+        return (resp_json.get("amountForClaim"),
+                resp_json.get("canClaim"))
         
     async def get_referral_code(self) -> str:
         """
         Gets referral
         """
-        resp = await self.session.get("https://gateway.blum.codes/v1/friends/balance", ssl=False)
-        resp_json = await resp.json()
-
-        referralToken = resp_json.get("referralToken")
+        resp_json = await self._friends_balance_raw()
 
-        if resp.status != 200:
-            await asyncio.sleep(1)
-            resp = await self.session.get("https://gateway.blum.codes/v1/friends/balance", ssl=False)
-            resp_json = await resp.json()
-            referralToken = resp_json.get("referralToken")
-        
-        return referralToken
+        return resp_json.get("referralToken")
 
     async def friend_claim(self):
-        resp = await self.session.post("https://gateway.blum.codes/v1/friends/claim", ssl=False)
-        resp_json = await resp.json()
-        amount = resp_json.get("claimBalance")
-        if resp.status != 200:
-            await asyncio.sleep(1)
-            resp = await self.session.post("https://gateway.blum.codes/v1/friends/claim", ssl=False)
-            resp_json = await resp.json()
-            amount = resp_json.get("claimBalance")
-        return amount
+        resp = await self._request_with_retry('POST', FRIENDS_CLAIM_URL)
+        async with resp:
+            resp_json = await self._json(resp)
+        self._friends_cache = None
+        return resp_json.get("claimBalance")
 
     async def balance(self):
         """
         Get the current balance and farming status.
         """
-        resp = await self.session.get("https://game-domain.blum.codes/api/v1/user/balance", ssl=False)
-        resp_json = await resp.json()
-        await asyncio.sleep(1)
-    
+        resp = await self._req('GET', BALANCE_URL)
+        async with resp:
+            resp_json = await self._json(resp)
+
         timestamp = resp_json.get("timestamp")
         play_passes = resp_json.get("playPasses")
         
@@ -237,9 +478,9 @@ class BlumBot:
             start_time = resp_json["farming"].get("startTime")
             end_time = resp_json["farming"].get("endTime")
     
-        return (int(timestamp / 1000) if timestamp is not None else None, 
-                int(start_time / 1000) if start_time is not None else None, 
-                int(end_time / 1000) if end_time is not None else None, 
+        return (timestamp // 1000 if timestamp is not None else None, 
+                start_time // 1000 if start_time is not None else None, 
+                end_time // 1000 if end_time is not None else None, 
                 play_passes)
 
     async def login(self):
@@ -249,14 +490,16 @@ class BlumBot:
         try:
             json_data = {"query": await self.account.get_tg_web_data()}
     
-            resp = await self.session.post("https://gateway.blum.codes/v1/auth/provider/PROVIDER_TELEGRAM_MINI_APP",
-                                           json=json_data, ssl=False)
-            resp_json = await resp.json()
+            resp = await self._req('POST', AUTH_PROVIDER_URL,
+                                           json=json_data)
+            async with resp:
+                resp_json = await self._json(resp)
     
-            self.session.headers['Authorization'] = "Bearer " + resp_json.get("token").get("access")
-            self.refresh_token = resp_json.get("token").get("refresh")
+            token = resp_json["token"]
+            self._apply_token(token["access"], token["refresh"])
             return True
-        except:
+        except (aiohttp.ClientError, asyncio.TimeoutError, KeyError, TypeError) as e:
+            logger.error(f"{self.account} | Login failed: {e}")
             return False
         
     async def register(self, referral_code: str, username: str):
@@ -269,14 +512,16 @@ class BlumBot:
             "username": username
         }
 
-        resp = await self.session.post("https://gateway.blum.codes/v1/auth/provider/PROVIDER_TELEGRAM_MINI_APP",
-                                        json=json_data, ssl=False)
-        resp_json = await resp.json()
-        if 'limit' in await resp.text():
+        resp = await self._req('POST', AUTH_PROVIDER_URL,
+                                        json=json_data)
+        async with resp:
+            text = await resp.text()
+        if 'limit' in text:
             raise RefCodeError('Referral token limit reached')
-        elif 'already connected' in await resp.text():
+        elif 'already connected' in text:
             raise AccountUsedError('Account already connected')
+        resp_json = json_loads(text) if text else {}
 
-        self.session.headers['Authorization'] = "Bearer " + resp_json.get("token").get("access")
-        self.refresh_token = resp_json.get("token").get("refresh")
+        token = resp_json["token"]
+        self._apply_token(token["access"], token["refresh"])
         return True
@@ -5,21 +5,13 @@ import secrets
 import aiohttp
 from aiohttp_proxy import ProxyConnector
 
-from .agents import generate_random_user_agent
 from utils.core import logger
 from utils.telegram import AccountInterface
 from utils.proxy import to_url
-from utils.blum import BlumBot, RefCodeError, AccountUsedError
+from utils.blum import BlumBot, RefCodeError, AccountUsedError, Session, get_shared_session, REQUEST_TIMEOUT
 from utils import db
 from data import config
 
-try:
-    from aiocfscrape import CloudflareScraper
-    Session = CloudflareScraper
-except:
-    logger.info("Error when importing aiocfscrape.CloudflareScraper, using aiohttp.ClientSession instead")
-    Session = aiohttp.ClientSession
-
 
 
 sem = Semaphore(config.ACCOUNT_PER_ONCE)
@@ -39,12 +31,14 @@ async def make_referrals(accounts: List[AccountInterface], refcode: str):
         async with sem:
             proxy = account.get_proxy()
             if proxy is None:
-                connector = None
+                session = get_shared_session()
+                own_session = None
             else:
-                connector = ProxyConnector.from_url(to_url(proxy))
-            async with Session(headers={'User-Agent': generate_random_user_agent(device_type='android',
-                                                                                        browser_type='chrome')},
-                                        timeout=aiohttp.ClientTimeout(total=60), connector=connector) as session:
+                session = own_session = Session(timeout=REQUEST_TIMEOUT,
+                                                connector=ProxyConnector.from_url(to_url(proxy), ssl=False,
+                                                                                  keepalive_timeout=75,
+                                                                                  enable_cleanup_closed=True))
+            try:
                 blum = BlumBot(account=account, session=session)
                 try:
                     await blum.register(refcode, f'user{secrets.token_hex(3)}')
@@ -79,3 +73,6 @@ async def make_referrals(accounts: List[AccountInterface], refcode: str):
                     await db.increment_referrals_count(refcode)
                 except:
                     logger.error(f"{account} | Failed to add account to db")
+            finally:
+                if own_session is not None:
+                    await own_session.close()
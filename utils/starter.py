@@ -5,21 +5,13 @@ from typing import Union
 import aiohttp
 from aiohttp_proxy import ProxyConnector
 
-from .agents import generate_random_user_agent
 from data import config
-from utils.blum import BlumBot
+from utils.blum import BlumBot, Session, get_shared_session, REQUEST_TIMEOUT
 from utils.core import logger
 from utils.helper import format_duration
 from utils.telegram import AccountInterface
 from utils.proxy import to_url
 
-try:
-    from aiocfscrape import CloudflareScraper
-    Session = CloudflareScraper
-except:
-    logger.info("Error when importing aiocfscrape.CloudflareScraper, using aiohttp.ClientSession instead")
-    Session = aiohttp.ClientSession
-
 
 sem = Semaphore(config.ACCOUNT_PER_ONCE)
 async def start(account: AccountInterface):
@@ -29,12 +21,14 @@ async def start(account: AccountInterface):
         async with sem:
             proxy = account.get_proxy()
             if proxy is None:
-                connector = None
+                session = get_shared_session()
+                own_session = None
             else:
-                connector = ProxyConnector.from_url(to_url(proxy))
-            async with Session(headers={'User-Agent': generate_random_user_agent(device_type='android',
-                                                                                        browser_type='chrome')},
-                                        timeout=aiohttp.ClientTimeout(total=60), connector=connector) as session:
+                session = own_session = Session(timeout=REQUEST_TIMEOUT,
+                                                connector=ProxyConnector.from_url(to_url(proxy), ssl=False,
+                                                                                  keepalive_timeout=75,
+                                                                                  enable_cleanup_closed=True))
+            try:
                 try:
                     blum = BlumBot(account=account, session=session)
                     max_try = 2
@@ -47,9 +41,8 @@ async def start(account: AccountInterface):
                         if isinstance(msg, bool) and msg:
                             logger.success(f"{account} | Claimed daily reward!")
 
-                        timestamp, start_time, end_time, play_passes = await blum.balance()
-
-                        claim_amount, is_available = await blum.friend_balance()
+                        ((timestamp, start_time, end_time, play_passes),
+                         (claim_amount, is_available)) = await blum.refresh_state()
                         # logger.info(f"{account} | {claim_amount} | {is_available}")
                         if claim_amount != 0 and is_available:
                             amount = await blum.friend_claim()
@@ -91,6 +84,9 @@ async def start(account: AccountInterface):
                         logger.error(f"{account} | Error: {e}")
                 except Exception as outer_e:
                     logger.error(f"{account} | Session error: {outer_e}")
+            finally:
+                if own_session is not None:
+                    await own_session.close()
         logger.info(f"{account} | Reconnecting in {format_duration(config.ITERATION_DURATION)}...")
         sleep_dur = config.ITERATION_DURATION
 